@@ -1,5 +1,4 @@
 """Configuration from environment (vLLM URL, model, timeouts)."""
-from functools import lru_cache
 from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -14,11 +13,50 @@ class Settings(BaseSettings):
     vllm_model: str = "Qwen/Qwen2.5-VL-7B-Instruct"  # model name as registered on vLLM
     vllm_timeout_seconds: float = 300.0
     vllm_max_tokens: int = 2048
+    # Получать ответ потоком (stream=True): таймаут считается между фрагментами, а не на весь ответ,
+    # поэтому длинная генерация не обрывается, пока модель выдаёт токены
+    vllm_stream: bool = False
+    # Сколько страниц одного PDF отправлять в vLLM одновременно (vLLM батчит их на своей стороне).
+    # Имеет смысл держать не больше --max-num-seqs сервера vLLM: лишние запросы просто встанут в его очередь
+    max_concurrent_pages: int = 4
+    # PDF до стольких страниц отправляется в vLLM одним запросом со всеми изображениями (0 — всегда по страницам).
+    # Нужно, чтобы все изображения + ответ помещались в --max-model-len, и vLLM с --limit-mm-per-prompt image=N
+    vllm_document_max_pages: int = 0
+    # Адрес этого сервиса, доступный с сервера vLLM (например http://172.17.0.1:8010). Если задан, vLLM получает
+    # ссылки на изображения страниц (/image/{sha256}) вместо base64 в теле запроса. Пусто — base64 data URI
+    vllm_image_base_url: Optional[str] = None
+    # Сколько секунд изображение доступно vLLM по ссылке
+    vllm_image_ttl_seconds: int = 600
+    # Сколько байт изображений для vLLM держать в памяти: при превышении вытесняются самые старые
+    vllm_image_max_bytes: int = 512 * 1024 * 1024
+
+    # Кэш ответов модели по содержимому страницы (+ модель и промпты): повторные/одинаковые страницы
+    # не отправляются в vLLM. ocr_cache_dir — кэш на диске (нужен diskcache), иначе LRU в памяти на
+    # ocr_cache_size страниц (0 — кэш выключен). Кэшируются только полностью разобранные ответы,
+    # не обрезанные по max_tokens; vllm_max_tokens входит в ключ
+    ocr_cache_dir: Optional[str] = None
+    ocr_cache_size: int = 256
 
     # Меньше DPI — меньше размер картинки и входных токенов, больше остаётся на ответ
     pdf_dpi: int = 150
+    # Формат изображений страниц для vLLM: jpeg (в разы меньше) или png (без потерь)
+    pdf_image_format: str = "jpeg"
+    pdf_jpeg_quality: int = 85
+    # Сколько процессов рендерят страницы PDF параллельно (0 — по числу ядер CPU)
+    pdf_render_workers: int = 0
+
+    # Максимальный размер загружаемого PDF (байт)
+    max_upload_bytes: int = 200 * 1024 * 1024
+
+    # Изображения страниц для интерфейса: длинная сторона в пикселях (0 — без уменьшения) и качество JPEG
+    ui_image_max_side: int = 1200
+    ui_jpeg_quality: int = 80
+
+    # Сколько секунд изображения страниц доступны интерфейсу по /page/{req_id}/{page_num}
+    page_image_ttl_seconds: int = 3600
+    # Сколько последних обработанных PDF хранить в памяти для интерфейса (старые вытесняются раньше TTL)
+    page_image_max_requests: int = 100
 
 
-@lru_cache
-def get_settings() -> Settings:
-    return Settings()
+# Единственный экземпляр настроек: .env читается один раз при импорте, а не при первом запросе
+SETTINGS: Settings = Settings()
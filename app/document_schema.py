@@ -1,5 +1,7 @@
 """Document structure: elements with bbox for JSON and markdown export."""
-from typing import Any, Dict, List, Literal, Optional
+import io
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, Literal, Optional, Tuple
 
 # Element types we expect from the model
 ElementType = Literal["text", "image", "table", "stamp", "signature"]
@@ -8,30 +10,42 @@ ElementType = Literal["text", "image", "table", "stamp", "signature"]
 # Frontend всегда масштабирует эти координаты под фактический размер изображения
 
 
+_TEXT_FORMAT = ("", "", "")
+
+# type элемента → (префикс, суффикс, текст по умолчанию); пустой блок пропускается
+_BLOCK_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    "text": _TEXT_FORMAT,
+    "table": ("", "", "*(таблица)*"),
+    "image": ("", "", "*(изображение)*"),
+    "stamp": ("*[Печать: ", "]*", "—"),
+    "signature": ("*[Подпись: ", "]*", "—"),
+}
+
+
 def document_to_markdown(elements: List[Dict[str, Any]], page_separator: str = "\n\n---\n\n") -> str:
     """Build markdown from structured elements (by page, then by order)."""
-    by_page: Dict[int, List[Dict[str, Any]]] = {}
+    by_page: DefaultDict[int, List[Dict[str, Any]]] = defaultdict(list)
     for el in elements:
-        p = el.get("page") if el.get("page") is not None else 1
-        by_page.setdefault(p, []).append(el)
+        page = el.get("page")
+        by_page[1 if page is None else page].append(el)
 
-    parts: List[str] = []
-    for page_num in sorted(by_page.keys()):
-        page_blocks: List[str] = []
+    buf = io.StringIO()
+    write = buf.write
+    for i, page_num in enumerate(sorted(by_page)):
+        if i:
+            write(page_separator)
+        first_block = True
         for el in by_page[page_num]:
-            el_type = (el.get("type") or "text").lower()
-            text = (el.get("text") or el.get("content") or "").strip()
-            if el_type == "table":
-                page_blocks.append(text if text else "*(таблица)*")
-            elif el_type == "image":
-                page_blocks.append(text if text else "*(изображение)*")
-            elif el_type == "stamp":
-                page_blocks.append(f"*[Печать: {text or '—'}]*")
-            elif el_type == "signature":
-                page_blocks.append(f"*[Подпись: {text or '—'}]*")
-            else:
-                if text:
-                    page_blocks.append(text)
-        parts.append("\n\n".join(page_blocks))
-
-    return page_separator.join(parts)
+            el_type = el.get("type") or "text"
+            prefix, suffix, default = _BLOCK_FORMATS.get(el_type) or _BLOCK_FORMATS.get(el_type.lower(), _TEXT_FORMAT)
+            text = (el.get("text") or el.get("content") or "").strip() or default
+            if not text:
+                continue
+            if not first_block:
+                write("\n\n")
+            first_block = False
+            write(prefix)
+            write(text)
+            write(suffix)
+
+    return buf.getvalue()
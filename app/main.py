@@ -2,22 +2,31 @@
 Qwen bbox OCR — загрузка PDF, конвертация в изображения, распознавание через vLLM (Qwen-VL),
 возврат JSON структуры документа и markdown. В интерфейсе — изображения страниц с bbox разметкой.
 """
-import base64
+import asyncio
 import logging
+import os
 import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 logger = logging.getLogger(__name__)
 
 from fastapi import FastAPI, File, Form, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
 
-from app.config import get_settings
+from app.config import SETTINGS
 from app.document_schema import document_to_markdown
-from app.pdf_utils import pdf_to_images
-from app.vllm_client import run_ocr_page
+from app.page_store import PageImageStore
+from app.pdf_utils import image_mime_type, make_display_image, pdf_to_images
+from app.vllm_client import close_async_client, image_blobs, run_ocr_document_async, run_ocr_pages_batch
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 МБ
+# PDF до этого размера держится в памяти (PyMuPDF открывает байты), больше — пишется во временный файл
+UPLOAD_MEMORY_BYTES = 32 << 20  # 32 МБ
 
 logging.basicConfig(
     level=logging.INFO,
@@ -31,6 +40,12 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# Изображения страниц отдаются отдельным запросом (/page/...), а не base64 в JSON ответа /parse
+page_store = PageImageStore(
+    ttl_seconds=SETTINGS.page_image_ttl_seconds,
+    max_requests=SETTINGS.page_image_max_requests,
+)
+
 app.mount(
     "/static",
     StaticFiles(directory=Path(__file__).parent / "static"),
@@ -38,6 +53,68 @@ app.mount(
 )
 
 
+class ParsedPage(BaseModel):
+    page: int
+    image_url: str
+    elements: List[Dict[str, Any]]
+    rotation_degrees: float
+
+
+class ParseResult(BaseModel):
+    filename: str
+    structure: List[Dict[str, Any]]
+    markdown: str
+    pages: List[ParsedPage]
+    num_pages: int
+
+
+def _dispatch_order(page_images: List[bytes]) -> List[int]:
+    """
+    Порядок отправки страниц в vLLM: по убыванию размера изображения.
+    Размер сжатого изображения — дешёвая оценка «плотности» страницы (таблицы, сплошной текст → длинный ответ),
+    поэтому одновременно в vLLM попадают страницы с близкой длиной генерации, а самые долгие стартуют первыми.
+    """
+    return sorted(range(len(page_images)), key=lambda i: len(page_images[i]), reverse=True)
+
+
+async def _receive_upload(file: UploadFile) -> Union[bytearray, Path, None]:
+    """
+    Прочитать загруженный PDF по частям с проверкой MAX_UPLOAD_BYTES. Небольшой файл остаётся в памяти,
+    больший UPLOAD_MEMORY_BYTES пишется во временный файл (его удаляет вызывающий). None — файл слишком большой.
+    """
+    content = bytearray()
+    size = 0
+    tmp = None
+    received = False
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > SETTINGS.max_upload_bytes:
+                break
+            if tmp is None and size > UPLOAD_MEMORY_BYTES:
+                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+                tmp.write(content)
+                content = bytearray()
+            if tmp is None:
+                content += chunk
+            else:
+                tmp.write(chunk)
+        received = size <= SETTINGS.max_upload_bytes
+    finally:
+        if tmp is not None:
+            tmp.close()
+            if not received:
+                os.unlink(tmp.name)
+    if not received:
+        return None
+    return content if tmp is None else Path(tmp.name)
+
+
+@app.on_event("shutdown")
+async def shutdown_vllm_client() -> None:
+    await close_async_client()
+
+
 @app.get("/healthz")
 def healthz() -> Dict[str, str]:
     return {"status": "ok", "service": "qwen-bbox-ocr"}
@@ -59,13 +136,43 @@ def get_default_prompts() -> Dict[str, str]:
     return {"system_prompt": SYSTEM_PROMPT, "user_prompt": USER_PROMPT_TEMPLATE}
 
 
-@app.post("/parse")
+@app.get("/page/{req_id}/{page_num}")
+def get_page_image(req_id: str, page_num: int):
+    """Изображение страницы из результата /parse (хранится в памяти PAGE_IMAGE_TTL_SECONDS)."""
+    img_bytes = page_store.get(req_id, page_num)
+    if img_bytes is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Страница не найдена или устарела"},
+        )
+    return Response(
+        content=img_bytes,
+        media_type=image_mime_type(img_bytes),
+        headers={"Cache-Control": "private, max-age=%d" % page_store.ttl_seconds},
+    )
+
+
+@app.get("/image/{digest}")
+def get_vllm_image(digest: str):
+    """Изображение страницы для vLLM по sha256 (используется, если задан VLLM_IMAGE_BASE_URL)."""
+    img_bytes = image_blobs.get(digest)
+    if img_bytes is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Изображение не найдено или устарело"},
+        )
+    return Response(content=img_bytes, media_type=image_mime_type(img_bytes))
+
+
+# Модель ответа: FastAPI сериализует тысячи элементов со bbox через Pydantic (новые версии — сразу в байты JSON),
+# без отдельного класса ответа; ошибки отдаются как JSONResponse в обход модели
+@app.post("/parse", response_model=ParseResult)
 async def parse_pdf(
     file: UploadFile = File(...),
     system_prompt: Optional[str] = Form(None),
     user_prompt: Optional[str] = Form(None),
 ):
-    """Загрузить PDF, конвертировать в изображения, отправить в vLLM по страницам; вернуть структуру + markdown + base64 страниц для отображения bbox. Опционально — кастомные system_prompt и user_prompt."""
+    """Загрузить PDF, конвертировать в изображения, отправить в vLLM по страницам; вернуть структуру + markdown + ссылки на изображения страниц для отображения bbox. Опционально — кастомные system_prompt и user_prompt."""
     filename = file.filename or "unknown.pdf"
     logger.info("parse: начало обработки файла %s", filename)
 
@@ -78,17 +185,35 @@ async def parse_pdf(
             content={"error": "Нужен файл PDF"},
         )
 
-    tmp_path: Path | None = None
+    tmp_path: Optional[Path] = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = Path(tmp.name)
-        logger.info("parse: PDF сохранён во временный файл, размер %s байт", len(content))
-
-        settings = get_settings()
-        logger.info("parse: конвертация PDF в изображения страниц (DPI=%s)...", settings.pdf_dpi)
-        page_images = pdf_to_images(tmp_path, dpi=settings.pdf_dpi)
+        content = await _receive_upload(file)
+        if content is None:
+            logger.warning("parse: отклонён файл %s — больше %s байт", filename, SETTINGS.max_upload_bytes)
+            return JSONResponse(
+                status_code=413,
+                content={"error": f"Файл больше допустимого размера ({SETTINGS.max_upload_bytes} байт)"},
+            )
+        if isinstance(content, Path):
+            tmp_path = content
+            logger.info("parse: PDF сохранён во временный файл, размер %s байт", tmp_path.stat().st_size)
+        else:
+            logger.info("parse: PDF получен, размер %s байт", len(content))
+
+        logger.info("parse: конвертация PDF в изображения страниц (DPI=%s)...", SETTINGS.pdf_dpi)
+        page_images = await asyncio.to_thread(
+            pdf_to_images,
+            content,
+            dpi=SETTINGS.pdf_dpi,
+            fmt=SETTINGS.pdf_image_format,
+            quality=SETTINGS.pdf_jpeg_quality,
+            workers=SETTINGS.pdf_render_workers,
+        )
+        # Загруженный PDF больше не нужен — не держим его, пока страницы распознаются
+        del content
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+            tmp_path = None
         if not page_images:
             logger.error("parse: в PDF нет страниц или конвертация не удалась")
             return JSONResponse(
@@ -100,24 +225,74 @@ async def parse_pdf(
 
         all_elements: List[Dict[str, Any]] = []
         pages_for_ui: List[Dict[str, Any]] = []
+        # Время по страницам — в одну итоговую строку лога вместо записей на каждую страницу:
+        # мс запроса к vLLM (без ожидания в очереди), "кэш" — ответ из кэша, "док" — страница из запроса по документу
+        page_times: List[Any] = [None] * num_pages
+        document_ms: Optional[int] = None
 
-        for i, img_bytes in enumerate(page_images):
-            page_num = i + 1
-            logger.info("parse: обработка страницы %s из %s...", page_num, num_pages)
-            result = run_ocr_page(
-                img_bytes,
-                page_num,
+        # Уменьшенные копии страниц для интерфейса готовятся в потоке, пока страницы распознаются в vLLM.
+        # Если распознавание упало, поток останавливается на следующей странице, а задача отменяется
+        display_stop = threading.Event()
+
+        def make_display_images() -> List[bytes]:
+            images: List[bytes] = []
+            for img in page_images:
+                if display_stop.is_set():
+                    break
+                images.append(make_display_image(img, SETTINGS.ui_image_max_side, SETTINGS.ui_jpeg_quality))
+            return images
+
+        display_task = asyncio.create_task(asyncio.to_thread(make_display_images))
+        try:
+            # Короткий документ с промптами по умолчанию — одним запросом со всеми страницами;
+            # страницы, которых нет в ответе, досылаются по одной
+            doc_results: Dict[int, Dict[str, Any]] = {}
+            use_document_request = (
+                1 < num_pages <= SETTINGS.vllm_document_max_pages
+                and not (system_prompt or "").strip()
+                and not (user_prompt or "").strip()
+            )
+            if use_document_request:
+                logger.info("parse: отправка всех %s страниц одним запросом...", num_pages)
+                started = time.perf_counter()
+                try:
+                    doc_results = await run_ocr_document_async(page_images)
+                except Exception as exc:
+                    logger.warning("parse: запрос по документу не удался (%s), отправка по страницам", exc)
+                document_ms = round((time.perf_counter() - started) * 1000)
+                for page_num in doc_results:
+                    page_times[page_num - 1] = "док"
+
+            order = [i for i in _dispatch_order(page_images) if i + 1 not in doc_results]
+            gathered = await run_ocr_pages_batch(
+                [(i + 1, page_images[i]) for i in order],
                 system_prompt=(system_prompt or "").strip() or None,
                 user_prompt=(user_prompt or "").strip() or None,
             )
+            results: List[Dict[str, Any]] = [doc_results.get(i + 1, {}) for i in range(num_pages)]
+            for i, (result, duration_ms) in zip(order, gathered):
+                results[i] = result
+                page_times[i] = "кэш" if duration_ms is None else duration_ms
+
+            display_images = await display_task
+        finally:
+            if not display_task.done():
+                display_stop.set()
+                display_task.cancel()
+            elif not display_task.cancelled():
+                display_task.exception()  # ошибка уже обработана — без «Task exception was never retrieved»
+
+        req_id = page_store.put(display_images)
+        for i, result in enumerate(results):
+            page_num = i + 1
             elements = result["elements"]
             rotation_degrees = result.get("page_rotation_degrees", 0) or 0
             all_elements.extend(elements)
-            logger.info("parse: страница %s — распознано элементов: %s, поворот: %s°", page_num, len(elements), rotation_degrees)
+            logger.debug("parse: страница %s — распознано элементов: %s, поворот: %s°", page_num, len(elements), rotation_degrees)
 
             pages_for_ui.append({
                 "page": page_num,
-                "image_base64": base64.b64encode(img_bytes).decode("ascii"),
+                "image_url": f"/page/{req_id}/{page_num}",
                 "elements": elements,
                 "rotation_degrees": rotation_degrees,
             })
@@ -125,7 +300,11 @@ async def parse_pdf(
         logger.info("parse: формирование markdown...")
         markdown = document_to_markdown(all_elements)
 
-        logger.info("parse: готово. Файл=%s, страниц=%s, элементов=%s", filename, num_pages, len(all_elements))
+        logger.info(
+            "parse: готово. Файл=%s, страниц=%s, элементов=%s, запрос по документу (мс)=%s, "
+            "время по страницам (мс без очереди; кэш/док)=%s",
+            filename, num_pages, len(all_elements), document_ms, page_times,
+        )
         return {
             "filename": filename,
             "structure": all_elements,
@@ -140,5 +319,5 @@ async def parse_pdf(
             content={"error": f"Ошибка обработки: {exc!s}"},
         )
     finally:
-        if tmp_path is not None and tmp_path.exists():
+        if tmp_path is not None:
             tmp_path.unlink(missing_ok=True)
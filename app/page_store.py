@@ -0,0 +1,115 @@
+"""
+In-memory stores of page images: for the UI (/page/{req_id}/{page_num}) and content-addressed
+images that vLLM fetches by URL (/image/{digest}). Entries live until TTL expires (vLLM images — until
+the request releases them) and both stores are size-capped.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class PageImageStore:
+    """
+    Page images of processed PDFs keyed by request id; thread-safe. Expired entries are purged on
+    write; beyond max_requests the oldest requests are evicted.
+    """
+
+    def __init__(self, ttl_seconds: float, max_requests: int = 100) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_requests = max(1, max_requests)
+        self._items: Dict[str, Tuple[float, List[bytes]]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, pages: List[bytes]) -> str:
+        """Store page images (page N is pages[N - 1]); return the request id."""
+        now = time.monotonic()
+        req_id = uuid.uuid4().hex
+        with self._lock:
+            self._purge(now)
+            # dict хранит порядок вставки — первыми вытесняются самые старые запросы
+            while len(self._items) >= self.max_requests:
+                del self._items[next(iter(self._items))]
+            self._items[req_id] = (now + self.ttl_seconds, pages)
+        return req_id
+
+    def get(self, req_id: str, page_num: int) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(req_id)
+            if item is None:
+                return None
+            expires_at, pages = item
+            if expires_at < time.monotonic():
+                del self._items[req_id]
+                return None
+        if not 1 <= page_num <= len(pages):
+            return None
+        return pages[page_num - 1]
+
+    def _purge(self, now: float) -> None:
+        """Drop expired entries; caller holds the lock."""
+        expired = [key for key, (expires_at, _) in self._items.items() if expires_at < now]
+        for key in expired:
+            del self._items[key]
+
+
+class ImageBlobStore:
+    """
+    Images keyed by sha256 of their bytes (identical pages share one entry); thread-safe.
+    An entry lives until every request that put it has released it (vLLM has fetched the image),
+    at most ttl_seconds; beyond max_bytes the oldest entries are evicted.
+    """
+
+    def __init__(self, ttl_seconds: float, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # digest -> [expires_at, data, refs]; порядок — по времени последнего put (первые истекают раньше)
+        self._items: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes) -> str:
+        """Store image bytes (or take one more reference to them); return the hex digest it is served under."""
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(digest)
+            if item is None:
+                self._items[digest] = [now + self.ttl_seconds, data, 1]
+                self._bytes += len(data)
+            else:
+                item[0] = now + self.ttl_seconds
+                item[2] += 1
+                self._items.move_to_end(digest)
+            self._evict(now)
+        return digest
+
+    def release(self, digest: str) -> None:
+        """Drop one reference taken by put; the image is removed when no request needs it."""
+        with self._lock:
+            item = self._items.get(digest)
+            if item is not None:
+                item[2] -= 1
+                if item[2] <= 0:
+                    self._remove(digest)
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(digest)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def _evict(self, now: float) -> None:
+        """Drop expired and, over max_bytes, oldest entries (never the newest one); caller holds the lock."""
+        while len(self._items) > 1:
+            digest, item = next(iter(self._items.items()))
+            if item[0] >= now and self._bytes <= self.max_bytes:
+                break
+            self._remove(digest)
+
+    def _remove(self, digest: str) -> None:
+        item = self._items.pop(digest)
+        self._bytes -= len(item[1])
@@ -1,56 +1,203 @@
 """Convert PDF to list of page images (PIL) for sending to vLLM."""
+import io
 import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List
+from typing import Any, List, Optional, Union
 
 logger = logging.getLogger(__name__)
 
 try:
-    from pdf2image import convert_from_path
+    import fitz  # PyMuPDF
 except ImportError:
-    convert_from_path = None  # type: ignore
+    fitz = None  # type: ignore
 
 try:
-    import fitz  # PyMuPDF
+    from pdf2image import convert_from_bytes, convert_from_path
 except ImportError:
-    fitz = None  # type: ignore
+    convert_from_bytes = convert_from_path = None  # type: ignore
+
+PdfSource = Union[bytes, Path]
 
 
-def pdf_to_images(pdf_path: Path, dpi: int = 150) -> List[bytes]:
+def image_mime_type(img_bytes: bytes) -> str:
+    """MIME type of an encoded page image (JPEG or PNG) by its signature."""
+    if img_bytes[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    return "image/png"
+
+
+def _encode_pil(img: Any, fmt: str, quality: int) -> bytes:
+    """Encode PIL image: JPEG for opaque pages, PNG if the page has alpha (JPEG cannot keep it)."""
+    buf = io.BytesIO()
+    has_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+    if fmt == "jpeg" and not has_alpha:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=quality, optimize=False)
+    else:
+        img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def make_display_image(img_bytes: bytes, max_side: int = 1200, quality: int = 80) -> bytes:
     """
-    Convert PDF to list of PNG images (bytes). Prefer pdf2image (poppler); fallback PyMuPDF.
-    Returns list of PNG bytes, one per page.
+    Downscaled JPEG copy of a page image for the web UI (the model gets the full-size image).
+    bbox are normalized 0–1000, so they need no rescaling. max_side <= 0 or a JPEG that already
+    fits — returned as is.
     """
-    logger.info("pdf_to_images: конвертация %s (DPI=%s)...", pdf_path.name, dpi)
-    if convert_from_path is not None:
-        pil_images = convert_from_path(pdf_path, dpi=dpi, fmt="png")
-        out: List[bytes] = []
-        import io
-
-        for img in pil_images:
-            buf = io.BytesIO()
-            img.save(buf, format="PNG")
-            out.append(buf.getvalue())
-        logger.info("pdf_to_images: готово (pdf2image), страниц: %s", len(out))
-        return out
+    if max_side <= 0:
+        return img_bytes
+    from PIL import Image
 
-    if fitz is not None:
-        doc = fitz.open(pdf_path)
-        out = []
-        for page in doc:
-            mat = fitz.Matrix(dpi / 72, dpi / 72)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            if hasattr(pix, "getPNGData"):
-                out.append(pix.getPNGData())
+    with Image.open(io.BytesIO(img_bytes)) as im:
+        # Image.open читает только заголовок: JPEG, уже влезающий в max_side, отдаётся без декодирования
+        if im.format == "JPEG" and max(im.size) <= max_side:
+            return img_bytes
+        im.thumbnail((max_side, max_side), Image.BILINEAR)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _open_pdf(source: Union[bytes, str, Path]) -> Any:
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def _render_pages(
+    source: Union[bytes, str, Path], start: int, stop: int, dpi: int, fmt: str, quality: int
+) -> List[bytes]:
+    """Render pages [start, stop) with PyMuPDF. Top-level so it can run in a worker process."""
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    out: List[bytes] = []
+    with _open_pdf(source) as doc:
+        for i in range(start, stop):
+            pix = doc.load_page(i).get_pixmap(matrix=mat, alpha=False)
+            if fmt == "jpeg" and not pix.alpha:
+                out.append(pix.tobytes("jpeg", jpg_quality=quality))
             else:
-                import io
-                from PIL import Image
-                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-                buf = io.BytesIO()
-                img.save(buf, format="PNG")
-                out.append(buf.getvalue())
-        doc.close()
-        logger.info("pdf_to_images: готово (PyMuPDF), страниц: %s", len(out))
+                out.append(pix.tobytes("png"))
+    return out
+
+
+# Пул процессов рендеринга на весь процесс приложения; создаётся и пересоздаётся под блокировкой
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_workers = 0
+_render_pool_lock = threading.Lock()
+
+
+def _get_render_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool reused across requests, sized by the configured worker count (one pool per process,
+    not per page count). spawn: the app process has threads, fork is unsafe.
+    """
+    global _render_pool, _render_pool_workers
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_workers != workers:
+            if _render_pool is not None:
+                _render_pool.shutdown(wait=False)
+            _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _render_pool_workers = workers
+        return _render_pool
+
+
+def _discard_render_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool (a worker died) so the next call builds a new one."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+
+def _render_pages_parallel(
+    source: Union[bytes, str], page_count: int, workers: int, dpi: int, fmt: str, quality: int
+) -> List[bytes]:
+    # Непрерывные диапазоны страниц на процесс: каждый воркер открывает PDF сам.
+    # Пул — по настроенному числу процессов; по числу страниц ограничивается только разбиение
+    jobs = min(workers, page_count)
+    step = -(-page_count // jobs)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    pool = _get_render_pool(workers)
+    try:
+        return _render_ranges(pool, source, ranges, dpi, fmt, quality)
+    except BrokenProcessPool:
+        # Воркер упал (сбой MuPDF, OOM): пул больше не принимает задачи — пересоздаём и пробуем ещё раз
+        _discard_render_pool(pool)
+        logger.warning("pdf_to_images: процесс рендеринга завершился аварийно, пул пересоздан")
+    pool = _get_render_pool(workers)
+    try:
+        return _render_ranges(pool, source, ranges, dpi, fmt, quality)
+    except BrokenProcessPool:
+        _discard_render_pool(pool)
+        raise
+
+
+def _render_ranges(
+    pool: ProcessPoolExecutor, source: Union[bytes, str], ranges: List[Any], dpi: int, fmt: str, quality: int
+) -> List[bytes]:
+    futures = [
+        pool.submit(_render_pages, source, start, stop, dpi, fmt, quality)
+        for start, stop in ranges
+    ]
+    return [img for future in futures for img in future.result()]
+
+
+def pdf_to_images(
+    source: PdfSource,
+    dpi: int = 150,
+    fmt: str = "jpeg",
+    quality: int = 85,
+    workers: int = 1,
+) -> List[bytes]:
+    """
+    Convert PDF (file path or PDF bytes) to list of page images (bytes). Bytes are sent to render
+    workers with each task, so pass large PDFs as a path. Prefer PyMuPDF
+    (in-process, opens bytes without a temp file, encodes straight from the MuPDF pixmap);
+    fallback pdf2image (poppler subprocess + PIL).
+    fmt: "jpeg" (default, several times smaller payload for vLLM) or "png" (lossless).
+    Pages with alpha channel are always encoded as PNG.
+    workers: number of processes rendering pages in parallel (0 — by CPU count).
+    Returns list of encoded image bytes, one per page.
+    """
+    fmt = fmt.lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    name = source.name if isinstance(source, Path) else f"<{len(source)} байт>"
+    logger.info("pdf_to_images: конвертация %s (DPI=%s, формат=%s)...", name, dpi, fmt)
+    if fitz is not None:
+        with _open_pdf(source) as doc:
+            page_count = doc.page_count
+        if workers <= 1 or page_count <= 1:
+            out = _render_pages(source, 0, page_count, dpi, fmt, quality)
+        else:
+            # Файл воркеры открывают по пути; байты (небольшой PDF из памяти) уходят в задачу через pipe —
+            # без записи на диск
+            path_or_bytes = str(source) if isinstance(source, Path) else bytes(source)
+            out = _render_pages_parallel(path_or_bytes, page_count, workers, dpi, fmt, quality)
+        logger.info(
+            "pdf_to_images: готово (PyMuPDF, процессов: %s), страниц: %s",
+            max(1, min(workers, page_count)), len(out),
+        )
+        return out
+
+    if convert_from_path is not None:
+        if isinstance(source, Path):
+            pil_images = convert_from_path(source, dpi=dpi, fmt="png", thread_count=workers)
+        else:
+            pil_images = convert_from_bytes(source, dpi=dpi, fmt="png", thread_count=workers)
+        out = [_encode_pil(img, fmt, quality) for img in pil_images]
+        logger.info("pdf_to_images: готово (pdf2image), страниц: %s", len(out))
         return out
 
-    raise RuntimeError("Install pdf2image (with poppler) or PyMuPDF to convert PDF to images.")
+    raise RuntimeError("Install PyMuPDF or pdf2image (with poppler) to convert PDF to images.")
@@ -1,19 +1,71 @@
 """
 Call vLLM (Qwen-VL) for document OCR: one image per request, structured JSON output.
-Expects OpenAI-compatible API: POST /v1/chat/completions with image_url (base64).
+Expects OpenAI-compatible API: POST /v1/chat/completions with image_url (base64 JPEG/PNG).
 """
+import asyncio
 import base64
 import json
 import logging
 import re
-from typing import Any, Dict, List, Optional
-
-from app.config import get_settings
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Dict, Final, List, Optional
+
+from app.config import SETTINGS
+from app.page_store import ImageBlobStore
+from app.pdf_utils import image_mime_type
+
+__all__ = [
+    "DOCUMENT_SYSTEM_PROMPT",
+    "DOCUMENT_USER_PROMPT_TEMPLATE",
+    "SYSTEM_PROMPT",
+    "USER_PROMPT_TEMPLATE",
+    "close_async_client",
+    "image_blobs",
+    "run_ocr_all_pages",
+    "run_ocr_document_async",
+    "run_ocr_page",
+    "run_ocr_page_async",
+    "run_ocr_pages_batch",
+]
 
 logger = logging.getLogger(__name__)
 
+try:
+    # SIMD base64 (SSSE3/AVX2/AVX-512, NEON на aarch64) — в разы быстрее stdlib на многомегабайтных страницах
+    from pybase64 import b64encode_as_string as _b64encode
+except ImportError:
+    def _b64encode(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+try:
+    # orjson (Rust, SIMD-валидация UTF-8) быстрее json.loads; orjson.JSONDecodeError — подкласс json.JSONDecodeError
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    # blake3 (SIMD, несколько ГБ/с) для ключей кэша ответов; иначе blake2b из stdlib
+    from blake3 import blake3 as _hasher
+except ImportError:
+    from hashlib import blake2b
+
+    def _hasher(data: bytes) -> Any:
+        return blake2b(data, digest_size=32)
 
-SYSTEM_PROMPT = """You are a deterministic document OCR and layout analysis system.
+try:
+    import h2  # noqa: F401 — HTTP/2 support for httpx
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+
+# Промпты — неизменяемые константы: одинаковый побайтно префикс запросов попадает в prefix cache vLLM
+SYSTEM_PROMPT: Final[str] = """You are a deterministic document OCR and layout analysis system.
 
 For the given SINGLE document page image, you MUST output ONE JSON object with EXACTLY the following shape:
 {
@@ -64,7 +116,7 @@ Example of a VALID response:
   ]
 }"""
 
-USER_PROMPT_TEMPLATE = (
+USER_PROMPT_TEMPLATE: Final[str] = (
     "Analyze ONLY this single page image. "
     "Return ONE JSON object with 'page_rotation_degrees' (page tilt in degrees, 0 if visually horizontal, "
     "positive for clockwise tilt, negative for counter-clockwise, including small scan skew like 1–5 degrees) "
@@ -75,89 +127,292 @@ USER_PROMPT_TEMPLATE = (
 )
 
 
-def _call_vllm_chat(
-    image_base64: str,
-    page_num: int,
+# Режим «весь документ одним запросом»: те же правила, что и для одной страницы (общий префикс промпта),
+# плюс требование вернуть массив объектов по страницам
+DOCUMENT_SYSTEM_PROMPT: Final[str] = SYSTEM_PROMPT + """
+
+MULTI-PAGE REQUEST (overrides the single-page output shape above):
+- This request contains SEVERAL page images of ONE document, in page order (the first image is page 1).
+- Apply all rules above to EACH image separately; bbox of an element are relative to ITS OWN page image.
+- Output ONE JSON array with exactly one object per image, in the same order:
+[
+  {"page": 1, "page_rotation_degrees": <number>, "elements": [...]},
+  {"page": 2, "page_rotation_degrees": <number>, "elements": [...]}
+]
+- Do NOT output anything except this JSON array."""
+
+DOCUMENT_USER_PROMPT_TEMPLATE: Final[str] = (
+    "Analyze each of the {num_pages} page images above separately. "
+    "Return ONE JSON array with one object per page ('page', 'page_rotation_degrees', 'elements'), in page order. "
+    "Do not add any prose, comments or markdown — only the JSON."
+)
+
+
+def _image_data_url(image_bytes: bytes) -> str:
+    """
+    data: URI for the image_url part. Holds the base64 string plus the URI copy (each ~1.33x the image);
+    VLLM_IMAGE_BASE_URL avoids both.
+    """
+    return f"data:{image_mime_type(image_bytes)};base64,{_b64encode(image_bytes)}"
+
+
+# Изображения, которые vLLM забирает по HTTP (VLLM_IMAGE_BASE_URL) вместо base64 в теле запроса
+image_blobs = ImageBlobStore(
+    ttl_seconds=SETTINGS.vllm_image_ttl_seconds,
+    max_bytes=SETTINGS.vllm_image_max_bytes,
+)
+
+
+def _image_url(image_bytes: bytes) -> tuple[str, Optional[str]]:
+    """
+    URL of the page image for vLLM: a link to /image/{sha256} on this service if VLLM_IMAGE_BASE_URL
+    is set (no base64 encode here and no decode in vLLM), otherwise a base64 data: URI.
+    Returns (url, digest); release the digest with _release_images once the completion returns.
+    """
+    if SETTINGS.vllm_image_base_url:
+        digest = image_blobs.put(image_bytes)
+        return f"{SETTINGS.vllm_image_base_url.rstrip('/')}/image/{digest}", digest
+    return _image_data_url(image_bytes), None
+
+
+def _release_images(*digests: Optional[str]) -> None:
+    # После ответа vLLM изображение уже скачано — не держим его до истечения TTL
+    for digest in digests:
+        if digest is not None:
+            image_blobs.release(digest)
+
+
+# Неизменяемые части запроса с промптами по умолчанию собираются один раз; на страницу — только image_url
+_SYSTEM_MSG: Dict[str, Any] = {"role": "system", "content": SYSTEM_PROMPT}
+_USER_TEXT_PART: Dict[str, Any] = {"type": "text", "text": USER_PROMPT_TEMPLATE}
+_DOCUMENT_SYSTEM_MSG: Dict[str, Any] = {"role": "system", "content": DOCUMENT_SYSTEM_PROMPT}
+
+
+def _build_messages(
+    image_url: str,
     system_prompt: Optional[str] = None,
     user_prompt: Optional[str] = None,
-) -> str:
-    settings = get_settings()
+) -> List[Dict[str, Any]]:
+    sys_content = (system_prompt or "").strip()
+    usr_content = (user_prompt or "").strip()
+    system_msg = {"role": "system", "content": sys_content} if sys_content else _SYSTEM_MSG
+    text_part = {"type": "text", "text": usr_content} if usr_content else _USER_TEXT_PART
+    # Текст перед изображением: system + user-промпт одинаковы для всех страниц и берутся из prefix cache,
+    # токены изображения (разные на каждой странице) идут в конце
+    return [
+        system_msg,
+        {"role": "user", "content": [text_part, {"type": "image_url", "image_url": {"url": image_url}}]},
+    ]
+
+
+def _build_document_messages(image_urls: List[str]) -> List[Dict[str, Any]]:
+    """Messages for one request with all pages: image_urls in page order."""
+    content: List[Dict[str, Any]] = [
+        {"type": "image_url", "image_url": {"url": url}} for url in image_urls
+    ]
+    content.append({"type": "text", "text": DOCUMENT_USER_PROMPT_TEMPLATE.format(num_pages=len(image_urls))})
+    return [_DOCUMENT_SYSTEM_MSG, {"role": "user", "content": content}]
+
+
+def _log_request(image_bytes_total: int, page_num: Any) -> None:
+    payload_size_kb = image_bytes_total // 1024
+    logger.debug(
+        "vLLM: отправка страницы %s в модель %s (размер изображения ~%s КБ, таймаут %s с)...",
+        page_num, SETTINGS.vllm_model, payload_size_kb, SETTINGS.vllm_timeout_seconds,
+    )
+
+
+def _response_text(response: Any, page_num: Any) -> tuple[str, Optional[str]]:
+    """(stripped response text, finish_reason); finish_reason "length" — cut by max_tokens."""
+    choice = response.choices[0] if response.choices else None
+    if not choice or not getattr(choice, "message", None):
+        logger.warning("vLLM: страница %s — пустой ответ модели", page_num)
+        return "[]", None
+    raw = getattr(choice.message, "content", None) or ""
+    logger.debug("vLLM: страница %s — ответ получен, длина %s символов", page_num, len(raw))
+    return raw.strip(), getattr(choice, "finish_reason", None)
+
+
+def _stream_response_text(chunks: List[Any], page_num: Any) -> tuple[str, Optional[str]]:
+    """Same as _response_text for a streamed response: joined deltas and the last finish_reason."""
+    parts: List[str] = []
+    finish_reason: Optional[str] = None
+    for chunk in chunks:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta and choice.delta.content:
+            parts.append(choice.delta.content)
+        finish_reason = getattr(choice, "finish_reason", None) or finish_reason
+    raw = "".join(parts)
+    logger.debug("vLLM: страница %s — ответ получен потоком, длина %s символов", page_num, len(raw))
+    return raw.strip(), finish_reason
+
+
+@lru_cache(maxsize=1)
+def _get_client() -> Any:
+    """
+    Shared OpenAI client for the sync path: keeps the keep-alive pool between pages instead of
+    a new client (and TCP/TLS handshake) per page. Thread-safe — run_ocr_all_pages calls it from a pool.
+    HTTP/2 (when h2 is installed) multiplexes concurrent pages over one connection.
+    """
     try:
+        import httpx
         from openai import OpenAI
     except ImportError:
         raise RuntimeError("Install openai package: pip install openai")
 
-    client = OpenAI(
-        base_url=settings.vllm_base_url.rstrip("/"),
-        api_key=settings.vllm_api_key or "dummy",
+    # Пул на все одновременные страницы с запасом: запросы не ждут свободного соединения
+    pool_size = max(1, SETTINGS.max_concurrent_pages) * 2
+    http_client = httpx.Client(
+        http2=_HTTP2,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=SETTINGS.vllm_timeout_seconds,
+    )
+    return OpenAI(
+        base_url=SETTINGS.vllm_base_url.rstrip("/"),
+        api_key=SETTINGS.vllm_api_key or "dummy",
+        http_client=http_client,
     )
 
-    sys_content = (system_prompt or "").strip() or SYSTEM_PROMPT
-    usr_content = (user_prompt or "").strip() or USER_PROMPT_TEMPLATE
 
-    content: List[Dict[str, Any]] = [
-        {
-            "type": "image_url",
-            "image_url": {"url": f"data:image/png;base64,{image_base64}"},
-        },
-        {"type": "text", "text": usr_content},
-    ]
+def _call_vllm_chat(
+    image_bytes: bytes,
+    page_num: int,
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+) -> tuple[str, Optional[str]]:
+    client = _get_client()
+    image_url, digest = _image_url(image_bytes)
+    _log_request(len(image_bytes), page_num)
+    messages = _build_messages(image_url, system_prompt, user_prompt)
+    try:
+        response = client.chat.completions.create(
+            model=SETTINGS.vllm_model,
+            messages=messages,
+            max_tokens=SETTINGS.vllm_max_tokens,
+            timeout=SETTINGS.vllm_timeout_seconds,
+            temperature=0.0,
+            top_p=1.0,
+            stream=SETTINGS.vllm_stream,
+        )
+        if SETTINGS.vllm_stream:
+            return _stream_response_text(list(response), page_num)
+    except Exception as e:
+        logger.exception(
+            "vLLM: страница %s — ошибка запроса: %s: %s",
+            page_num, type(e).__name__, e,
+        )
+        raise
+    finally:
+        _release_images(digest)
+    return _response_text(response, page_num)
 
-    payload_size_kb = (len(image_base64) * 3 // 4) // 1024  # приблизительный размер PNG в КБ
-    logger.info(
-        "vLLM: отправка страницы %s в модель %s (размер изображения ~%s КБ, таймаут %s с)...",
-        page_num, settings.vllm_model, payload_size_kb, settings.vllm_timeout_seconds,
+
+@lru_cache(maxsize=1)
+def _get_async_client() -> Any:
+    """
+    Shared AsyncOpenAI client: one keep-alive connection pool for all pages and requests
+    (no TCP/TLS handshake per page). HTTP/2 is used when h2 is installed.
+    """
+    try:
+        import httpx
+        from openai import AsyncOpenAI
+    except ImportError:
+        raise RuntimeError("Install openai package: pip install openai")
+
+    http_client = httpx.AsyncClient(
+        http2=_HTTP2,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=SETTINGS.vllm_timeout_seconds,
+    )
+    return AsyncOpenAI(
+        base_url=SETTINGS.vllm_base_url.rstrip("/"),
+        api_key=SETTINGS.vllm_api_key or "dummy",
+        http_client=http_client,
     )
+
+
+async def close_async_client() -> None:
+    """Close the shared AsyncOpenAI client (on application shutdown)."""
+    if _get_async_client.cache_info().currsize:
+        await _get_async_client().close()
+        _get_async_client.cache_clear()
+
+
+async def _complete_async(messages: List[Dict[str, Any]], page_num: Any) -> tuple[str, Optional[str]]:
+    client = _get_async_client()
     try:
-        response = client.chat.completions.create(
-            model=settings.vllm_model,
-            messages=[
-                {"role": "system", "content": sys_content},
-                {"role": "user", "content": content},
-            ],
-            max_tokens=settings.vllm_max_tokens,
-            timeout=settings.vllm_timeout_seconds,
+        response = await client.chat.completions.create(
+            model=SETTINGS.vllm_model,
+            messages=messages,
+            max_tokens=SETTINGS.vllm_max_tokens,
+            timeout=SETTINGS.vllm_timeout_seconds,
             temperature=0.0,
             top_p=1.0,
+            stream=SETTINGS.vllm_stream,
         )
+        if SETTINGS.vllm_stream:
+            return _stream_response_text([chunk async for chunk in response], page_num)
     except Exception as e:
         logger.exception(
             "vLLM: страница %s — ошибка запроса: %s: %s",
             page_num, type(e).__name__, e,
         )
         raise
-    choice = response.choices[0] if response.choices else None
-    if not choice or not getattr(choice, "message", None):
-        logger.warning("vLLM: страница %s — пустой ответ модели", page_num)
-        return "[]"
-    raw = getattr(choice.message, "content", None) or ""
-    logger.info("vLLM: страница %s — ответ получен, длина %s символов", page_num, len(raw))
-    return raw.strip()
+    return _response_text(response, page_num)
 
 
-def _extract_json_string(raw: str) -> Optional[str]:
-    """Extract JSON object or array string from model output (markdown, prefix text, etc.)."""
-    raw = raw.strip()
-    m = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", raw)
+async def _call_vllm_chat_async(
+    image_bytes: bytes,
+    page_num: int,
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+) -> tuple[str, Optional[str]]:
+    image_url, digest = _image_url(image_bytes)
+    _log_request(len(image_bytes), page_num)
+    messages = _build_messages(image_url, system_prompt, user_prompt)
+    try:
+        return await _complete_async(messages, page_num)
+    finally:
+        _release_images(digest)
+
+
+# Ответ модели в markdown-блоке ```json ... ``` и поле поворота в (возможно обрезанном) ответе
+_CODEBLOCK_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```")
+_ROTATION_RE = re.compile(r'"page_rotation_degrees"\s*:\s*(-?\d+(?:\.\d+)?)')
+# Пробелы и запятые между элементами массива (для разбора обрезанного ответа)
+_SKIP_SEPARATORS_RE = re.compile(r"[\s,]*")
+_JSON_DECODER = json.JSONDecoder()
+# Висячая запятая перед ] или } (допускается с пробелами между ними)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[\]}])")
+
+
+def _extract_json_string(raw: str, prefer_array: bool = False) -> Optional[str]:
+    """
+    Extract JSON object or array string from stripped model output (markdown, prefix text, etc.).
+    prefer_array: after prose, start at the first '[' rather than the first '{' (multi-page response).
+    """
+    m = _CODEBLOCK_RE.search(raw)
     if m:
-        return m.group(1).strip()
+        return m.group(1)
     if raw.startswith("{") or raw.startswith("["):
         return raw
-    start = raw.find("{")
+    first, second = ("[", "{") if prefer_array else ("{", "[")
+    start = raw.find(first)
     if start == -1:
-        start = raw.find("[")
+        start = raw.find(second)
     if start == -1:
         return None
     return raw[start:]
 
 
 def _extract_json_array_string(raw: str) -> Optional[str]:
-    """Extract string that should be a JSON array from model output (markdown, prefix text, etc.)."""
-    raw = raw.strip()
-    # 1) Markdown code block ```json ... ``` or ``` ... ```
-    m = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", raw)
+    """Extract string that should be a JSON array from stripped model output (markdown, prefix text, etc.)."""
+    # 1) Markdown code block ```json ... ``` or ``` ... ``` (regex already excludes surrounding whitespace)
+    m = _CODEBLOCK_RE.search(raw)
     if m:
-        return m.group(1).strip()
+        return m.group(1)
     # 2) Raw string is the array
     if raw.startswith("["):
         return raw
@@ -200,70 +455,62 @@ def _extract_json_array_string(raw: str) -> Optional[str]:
 
 
 def _repair_truncated_json_array(extracted: str) -> Optional[List[Dict[str, Any]]]:
-    """If the model response was cut by max_tokens, find last complete object and close the array."""
-    s = extracted.strip()
+    """
+    If the model response was cut by max_tokens, keep the complete leading objects of the array.
+    Items are decoded one by one with JSONDecoder.raw_decode (C scanner) until the first incomplete one.
+    """
+    s = extracted
     if not s.startswith("["):
         return None
-    # Track depth: array [ and object {. Find last position where we have }, and depth is 1,0.
-    array_depth = 0
-    object_depth = 0
-    in_string = False
-    escape = False
-    quote = None
-    last_complete_end = -1
-    i = 0
-    while i < len(s):
-        c = s[i]
-        if escape:
-            escape = False
-            i += 1
-            continue
-        if in_string:
-            if c == "\\":
-                escape = True
-            elif c == quote:
-                in_string = False
-            i += 1
-            continue
-        if c in ("'", '"'):
-            in_string = True
-            quote = c
-            i += 1
-            continue
-        if c == "[":
-            array_depth += 1
-        elif c == "]":
-            array_depth -= 1
-        elif c == "{":
-            object_depth += 1
-        elif c == "}":
-            object_depth -= 1
-            if array_depth == 1 and object_depth == 0:
-                last_complete_end = i
-        i += 1
-    if last_complete_end == -1:
-        return None
-    repaired = s[: last_complete_end + 1] + "\n]"
+    items: List[Dict[str, Any]] = []
+    idx = _SKIP_SEPARATORS_RE.match(s, 1).end()
+    while idx < len(s) and s[idx] != "]":
+        try:
+            item, idx = _JSON_DECODER.raw_decode(s, idx)
+        except json.JSONDecodeError:
+            break
+        if isinstance(item, dict):
+            items.append(item)
+        idx = _SKIP_SEPARATORS_RE.match(s, idx).end()
+    return items or None
+
+
+def _loads_lenient(s: str) -> Any:
+    """json.loads; only if it fails, retry once with trailing commas removed (one regex pass)."""
     try:
-        return json.loads(repaired)
+        return _json_loads(s)
+    except json.JSONDecodeError:
+        return _json_loads(_TRAILING_COMMA_RE.sub(r"\1", s))
+
+
+def _loads_array(s: str) -> Optional[List[Dict[str, Any]]]:
+    try:
+        data = _json_loads(s)
     except json.JSONDecodeError:
         return None
+    return data if isinstance(data, list) else None
 
 
 def _parse_json_array(raw: str) -> List[Dict[str, Any]]:
-    """Extract JSON array from model output (may be wrapped in markdown or text)."""
-    raw = raw.strip()
+    """Extract JSON array from stripped model output (may be wrapped in markdown or text)."""
     if not raw:
         return []
+    # Быстрый путь: ответ — чистый JSON-массив или массив в одном markdown-блоке
+    data = _loads_array(raw)
+    if data is None:
+        m = _CODEBLOCK_RE.search(raw)
+        if m:
+            data = _loads_array(m.group(1))
+    if data is not None:
+        return data
     extracted = _extract_json_array_string(raw)
     if extracted is None:
         if raw:
             logger.info("vLLM: фрагмент ответа (парсинг не удался): %.800s", raw)
         return []
-    # Try parse; allow trailing comma in array (replace ",]") for robustness
-    normalized = extracted.replace(",]", "]").replace(",}", "}")
+    # Try parse; allow trailing comma in array for robustness
     try:
-        return json.loads(normalized)
+        return _loads_lenient(extracted)
     except json.JSONDecodeError as e:
         repaired = _repair_truncated_json_array(extracted)
         if repaired is not None:
@@ -275,7 +522,7 @@ def _parse_json_array(raw: str) -> List[Dict[str, Any]]:
 
 def _extract_rotation_from_raw(raw: str) -> float:
     """Try to get page_rotation_degrees from raw string (e.g. truncated object)."""
-    m = re.search(r'"page_rotation_degrees"\s*:\s*(-?\d+(?:\.\d+)?)', raw)
+    m = _ROTATION_RE.search(raw)
     if m:
         try:
             return float(m.group(1))
@@ -284,29 +531,14 @@ def _extract_rotation_from_raw(raw: str) -> float:
     return 0.0
 
 
-def _parse_page_response(raw: str) -> tuple[List[Dict[str, Any]], float]:
-    """
-    Parse model response: object {page_rotation_degrees, elements} or plain array.
-    Returns (elements, rotation_degrees). Each page is sent alone — no previous pages in context.
-    """
-    raw = raw.strip()
-    if not raw:
-        return [], 0.0
-    extracted = _extract_json_string(raw)
-    if not extracted:
-        return _parse_json_array(raw), 0.0
-    normalized = extracted.replace(",]", "]").replace(",}", "}")
-    try:
-        data = json.loads(normalized)
-    except json.JSONDecodeError:
-        elements, rotation = _parse_page_response_fallback(raw, extracted)
-        return elements, rotation
+def _page_elements(data: Any) -> tuple[List[Dict[str, Any]], float]:
+    """Interpret decoded page JSON: object {page_rotation_degrees, elements} or plain array."""
     if isinstance(data, dict):
         elements = data.get("elements")
         rotation = float(data.get("page_rotation_degrees", 0) or 0)
         if isinstance(elements, list):
             if rotation != 0:
-                logger.info("vLLM: определён поворот страницы: %s градусов", rotation)
+                logger.debug("vLLM: определён поворот страницы: %s градусов", rotation)
             return elements, rotation
         if elements is not None:
             return [], rotation
@@ -316,6 +548,32 @@ def _parse_page_response(raw: str) -> tuple[List[Dict[str, Any]], float]:
     return [], 0.0
 
 
+def _parse_page_response(raw: str) -> tuple[List[Dict[str, Any]], float, bool]:
+    """
+    Parse model response: object {page_rotation_degrees, elements} or plain array.
+    Returns (elements, rotation_degrees, complete); complete — the whole JSON was decoded, not
+    salvaged from a truncated/broken response. Each page is sent alone — no previous pages in context.
+    The only strip of the response: helpers below expect already stripped text.
+    """
+    raw = raw.strip()
+    if not raw:
+        return [], 0.0, False
+    # Быстрый путь: модель вернула чистый JSON — без regex и нормализации строки
+    if raw[0] in "{[":
+        try:
+            return (*_page_elements(_json_loads(raw)), True)
+        except json.JSONDecodeError:
+            pass
+    extracted = _extract_json_string(raw)
+    if not extracted:
+        return _parse_json_array(raw), 0.0, False
+    try:
+        data = _loads_lenient(extracted)
+    except json.JSONDecodeError:
+        return (*_parse_page_response_fallback(raw, extracted), False)
+    return (*_page_elements(data), True)
+
+
 def _parse_page_response_fallback(raw: str, extracted: str) -> tuple[List[Dict[str, Any]], float]:
     """
     When full object parse failed (e.g. truncated): try to get 'elements' array from raw.
@@ -330,9 +588,8 @@ def _parse_page_response_fallback(raw: str, extracted: str) -> tuple[List[Dict[s
         arr_start = extracted.find("[", idx)
         if arr_start != -1:
             arr_str = extracted[arr_start:]
-            normalized = arr_str.replace(",]", "]").replace(",}", "}")
             try:
-                return json.loads(normalized), rotation
+                return _loads_lenient(arr_str), rotation
             except json.JSONDecodeError:
                 repaired = _repair_truncated_json_array(arr_str)
                 if repaired is not None:
@@ -342,6 +599,125 @@ def _parse_page_response_fallback(raw: str, extracted: str) -> tuple[List[Dict[s
     return elements, rotation
 
 
+def _parse_document_response(raw: str, num_pages: int) -> Dict[int, tuple[List[Dict[str, Any]], float]]:
+    """
+    Parse multi-page response: array of {page, page_rotation_degrees, elements} (or {"pages": [...]}).
+    Returns {page_num: (elements, rotation_degrees)} only for pages found in the response.
+    """
+    extracted = _extract_json_string(raw, prefer_array=True)
+    if not extracted:
+        return {}
+    try:
+        data: Any = _loads_lenient(extracted)
+    except json.JSONDecodeError:
+        data = _repair_truncated_json_array(extracted)
+        if data is None:
+            return {}
+        logger.info("vLLM: ответ по документу обрезан по токенам, использовано %s полных страниц", len(data))
+    if isinstance(data, dict):
+        data = data.get("pages")
+    if not isinstance(data, list):
+        return {}
+    pages: Dict[int, tuple[List[Dict[str, Any]], float]] = {}
+    for idx, item in enumerate(data):
+        if not isinstance(item, dict) or not isinstance(item.get("elements"), list):
+            continue
+        page = item.get("page")
+        page_num = page if isinstance(page, int) and 1 <= page <= num_pages else idx + 1
+        if page_num > num_pages or page_num in pages:
+            continue
+        try:
+            rotation = float(item.get("page_rotation_degrees", 0) or 0)
+        except (TypeError, ValueError):
+            rotation = 0.0
+        pages[page_num] = (item["elements"], rotation)
+    return pages
+
+
+class _LruCache:
+    """Small thread-safe in-memory LRU (used when OCR_CACHE_DIR / diskcache is not configured)."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def _get_ocr_cache() -> Any:
+    """Cache of raw model responses: diskcache in OCR_CACHE_DIR if set, else in-memory LRU; None — disabled."""
+    if SETTINGS.ocr_cache_dir:
+        try:
+            import diskcache
+        except ImportError:
+            logger.warning("vLLM: OCR_CACHE_DIR задан, но diskcache не установлен — кэш в памяти")
+        else:
+            return diskcache.Cache(SETTINGS.ocr_cache_dir)
+    if SETTINGS.ocr_cache_size > 0:
+        return _LruCache(SETTINGS.ocr_cache_size)
+    return None
+
+
+def _ocr_cache_key(image_bytes: bytes, system_prompt: Optional[str], user_prompt: Optional[str]) -> str:
+    """Key: hash of the image bytes + model + max_tokens + hash of the effective prompts."""
+    sys_content = (system_prompt or "").strip() or SYSTEM_PROMPT
+    usr_content = (user_prompt or "").strip() or USER_PROMPT_TEMPLATE
+    prompts_hash = _hasher(f"{sys_content}\0{usr_content}".encode("utf-8")).hexdigest()[:16]
+    return f"{_hasher(image_bytes).hexdigest()}:{SETTINGS.vllm_model}:{SETTINGS.vllm_max_tokens}:{prompts_hash}"
+
+
+def _cacheable(complete: bool, finish_reason: Optional[str]) -> bool:
+    """
+    Only a fully parsed response that the model finished itself goes to the cache: a truncated
+    (finish_reason "length"), empty or broken answer must not be replayed on retry.
+    """
+    return complete and finish_reason == "stop"
+
+
+async def _cache_get_async(cache: Any, key: str) -> Optional[str]:
+    # diskcache читает с диска — не в цикле событий
+    if isinstance(cache, _LruCache):
+        return cache.get(key)
+    return await asyncio.to_thread(cache.get, key)
+
+
+async def _cache_set_async(cache: Any, key: str, value: str) -> None:
+    if isinstance(cache, _LruCache):
+        cache.set(key, value)
+    else:
+        await asyncio.to_thread(cache.set, key, value)
+
+
+def _build_page_result(raw: str, page_num: int) -> tuple[Dict[str, Any], bool]:
+    """(page result, complete) — complete as returned by _parse_page_response."""
+    items, rotation, complete = _parse_page_response(raw)
+    if not items and raw:
+        logger.warning("vLLM: страница %s — не удалось распарсить JSON из ответа (%s символов)", page_num, len(raw))
+    return _page_result(items, rotation, page_num), complete
+
+
+def _page_result(items: List[Dict[str, Any]], rotation: float, page_num: int) -> Dict[str, Any]:
+    for el in items:
+        el["page"] = page_num
+        if "content" in el:
+            el.setdefault("text", el["content"])
+    return {"elements": items, "page_rotation_degrees": rotation}
+
+
 def run_ocr_page(
     image_png_bytes: bytes,
     page_num: int,
@@ -353,24 +729,120 @@ def run_ocr_page(
     Returns {"elements": [...], "page_rotation_degrees": float}.
     Optional system_prompt / user_prompt override defaults.
     """
-    b64 = base64.b64encode(image_png_bytes).decode("ascii")
-    logger.info("vLLM: страница %s — размер PNG %s байт, base64 %s символов", page_num, len(image_png_bytes), len(b64))
-    raw = _call_vllm_chat(b64, page_num, system_prompt=system_prompt, user_prompt=user_prompt)
-    items, rotation = _parse_page_response(raw)
-    if not items and raw.strip():
-        logger.warning("vLLM: страница %s — не удалось распарсить JSON из ответа (%s символов)", page_num, len(raw))
-    for el in items:
-        el["page"] = page_num
-        if "content" in el and "text" not in el:
-            el["text"] = el["content"]
-    return {"elements": items, "page_rotation_degrees": rotation}
+    logger.debug("vLLM: страница %s — изображение %s байт", page_num, len(image_png_bytes))
+    cache = _get_ocr_cache()
+    key = _ocr_cache_key(image_png_bytes, system_prompt, user_prompt) if cache is not None else ""
+    raw = cache.get(key) if cache is not None else None
+    if raw is not None:
+        logger.debug("vLLM: страница %s — ответ из кэша", page_num)
+        return _build_page_result(raw, page_num)[0]
+    raw, finish_reason = _call_vllm_chat(image_png_bytes, page_num, system_prompt=system_prompt, user_prompt=user_prompt)
+    result, complete = _build_page_result(raw, page_num)
+    if cache is not None and _cacheable(complete, finish_reason):
+        cache.set(key, raw)
+    return result
+
+
+async def run_ocr_page_async(
+    image_png_bytes: bytes,
+    page_num: int,
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Async variant of run_ocr_page: pages of one document can be sent concurrently,
+    so vLLM batches them (continuous batching) instead of serving them one by one.
+    """
+    result, _ = await _ocr_page_async(image_png_bytes, page_num, system_prompt, user_prompt)
+    return result
+
+
+async def _ocr_page_async(
+    image_png_bytes: bytes,
+    page_num: int,
+    system_prompt: Optional[str],
+    user_prompt: Optional[str],
+) -> tuple[Dict[str, Any], bool]:
+    """(page result, cached) — cached: the response came from the OCR cache, vLLM was not called."""
+    logger.debug("vLLM: страница %s — изображение %s байт", page_num, len(image_png_bytes))
+    cache = _get_ocr_cache()
+    key = _ocr_cache_key(image_png_bytes, system_prompt, user_prompt) if cache is not None else ""
+    raw = await _cache_get_async(cache, key) if cache is not None else None
+    if raw is not None:
+        logger.debug("vLLM: страница %s — ответ из кэша", page_num)
+        return _build_page_result(raw, page_num)[0], True
+    raw, finish_reason = await _call_vllm_chat_async(
+        image_png_bytes, page_num, system_prompt=system_prompt, user_prompt=user_prompt
+    )
+    result, complete = _build_page_result(raw, page_num)
+    if cache is not None and _cacheable(complete, finish_reason):
+        await _cache_set_async(cache, key, raw)
+    return result, False
+
+
+async def run_ocr_document_async(page_images: List[bytes]) -> Dict[int, Dict[str, Any]]:
+    """
+    Send all pages in ONE chat request (several image_url parts): one prefill and one HTTP round-trip
+    for the whole document. Returns {page_num: {"elements": [...], "page_rotation_degrees": float}}
+    for the pages the model answered; missing pages should be sent one by one (run_ocr_page_async).
+    """
+    num_pages = len(page_images)
+    image_urls, digests = zip(*[_image_url(b) for b in page_images])
+    page_label = f"1–{num_pages}"
+    _log_request(sum(map(len, page_images)), page_label)
+    messages = _build_document_messages(list(image_urls))
+    try:
+        raw, _ = await _complete_async(messages, page_label)
+    finally:
+        _release_images(*digests)
+    parsed = _parse_document_response(raw, num_pages)
+    if len(parsed) < num_pages:
+        logger.warning("vLLM: ответ по документу содержит %s из %s страниц", len(parsed), num_pages)
+    return {
+        page_num: _page_result(items, rotation, page_num)
+        for page_num, (items, rotation) in parsed.items()
+    }
+
+
+async def run_ocr_pages_batch(
+    pages: List[tuple[int, bytes]],
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+) -> List[tuple[Dict[str, Any], Optional[int]]]:
+    """
+    OCR several pages concurrently: up to MAX_CONCURRENT_PAGES requests in flight, so vLLM
+    schedules them in one batch (continuous batching). pages are (page_num, image_bytes) pairs.
+    Returns (result, duration_ms) in the same order: duration_ms is the page's own time once it got
+    a slot (waiting for the semaphore excluded), None if the response came from the cache.
+    The first failed page cancels the others and its exception is re-raised.
+    """
+    semaphore = asyncio.Semaphore(max(1, SETTINGS.max_concurrent_pages))
+
+    async def ocr_page(page_num: int, image_bytes: bytes) -> tuple[Dict[str, Any], Optional[int]]:
+        async with semaphore:
+            started = time.perf_counter()
+            result, cached = await _ocr_page_async(image_bytes, page_num, system_prompt, user_prompt)
+            return result, None if cached else round((time.perf_counter() - started) * 1000)
+
+    # TaskGroup: при ошибке одной страницы остальные запросы отменяются, а не занимают GPU впустую
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(ocr_page(page_num, image_bytes)) for page_num, image_bytes in pages]
+    except BaseExceptionGroup as group_error:
+        raise group_error.exceptions[0]
+    return [task.result() for task in tasks]
 
 
 def run_ocr_all_pages(page_images: List[bytes]) -> List[Dict[str, Any]]:
-    """Run OCR for each page; return concatenated list of elements with page numbers."""
-    all_elements: List[Dict[str, Any]] = []
-    for i, img_bytes in enumerate(page_images):
-        page_num = i + 1
-        result = run_ocr_page(img_bytes, page_num)
-        all_elements.extend(result["elements"])
-    return all_elements
+    """
+    Sync variant of run_ocr_pages_batch for scripts: up to MAX_CONCURRENT_PAGES pages in flight on the
+    shared sync client (threads, no event loop — safe to call while the server runs); return
+    concatenated list of elements with page numbers, in page order.
+    """
+    workers = max(1, min(SETTINGS.max_concurrent_pages, len(page_images)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda item: run_ocr_page(item[1], item[0] + 1),
+            enumerate(page_images),
+        )
+        return list(chain.from_iterable(result["elements"] for result in results))